@@ -3,37 +3,132 @@ import logging
 import asyncio
 import aiohttp
 import socket
+import time
+from collections import deque
+from dataclasses import asdict, dataclass
 from datetime import datetime
-from typing import List, Dict
-import dns.asyncresolver  # Changed to asyncresolver
+from typing import Dict, Tuple
+import dns.asyncresolver
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.core import HomeAssistant
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
 import voluptuous as vol
-import homeassistant.helpers.config_validation as cv
-from homeassistant.const import CONF_NAME
-from homeassistant.exceptions import HomeAssistantError
 
 _LOGGER = logging.getLogger(__name__)
 
 DOMAIN = "internet_health"
 
+# Seconds allowed for a whole check_all run and for any single probe in it
+_CHECK_TIMEOUT = 30
+_PROBE_TIMEOUT = 5
+
+# Seconds to reuse successful / failed DNS lookups
+DNS_CACHE_TTL = 300
+DNS_NEGATIVE_CACHE_TTL = 30
+
+# Contribution of each check type to the confidence score
+_CONFIDENCE_WEIGHTS = (
+    ('tcp', 0.45),
+    ('http', 0.35),
+    ('dns', 0.20)
+)
+
+# Minimum confidence (percent) for the connection to be reported online
+_CONFIDENCE_THRESHOLD = 60
+
+# Probe targets
+_NAMESERVERS = (
+    ('8.8.8.8', 'Google'),
+    ('1.1.1.1', 'Cloudflare'),
+    ('9.9.9.9', 'Quad9'),
+    ('208.67.222.222', 'OpenDNS')
+)
+_TCP_TARGETS = (
+    ('google.com', 'Google'),
+    ('amazon.com', 'Amazon'),
+    ('cloudflare.com', 'Cloudflare'),
+    ('github.com', 'GitHub'),
+    ('microsoft.com', 'Microsoft')
+)
+_TCP_PORTS = (80, 443)
+# Single cheap probe used to skip the full suite when the link is down
+_QUICK_TCP_TARGET = ('1.1.1.1', 443)
+_QUICK_TCP_TIMEOUT = 2
+_TCP_PROBES = tuple((host, name, port) for host, name in _TCP_TARGETS for port in _TCP_PORTS)
+# Connectivity-check endpoints with tiny fixed responses; a redirect
+# or any other status usually means a captive portal is in the way
+_HTTP_URLS = (
+    ('http://www.gstatic.com/generate_204', 204),
+    ('http://detectportal.firefox.com/success.txt', 200),
+    ('http://captive.apple.com/hotspot-detect.html', 200)
+)
+
+# Probe counts and how many must pass for each check to succeed
+_DNS_TOTAL = len(_NAMESERVERS)
+_DNS_THRESHOLD = 2
+_TCP_TOTAL = len(_TCP_PROBES)
+_TCP_THRESHOLD = _TCP_TOTAL // 2
+_HTTP_TOTAL = len(_HTTP_URLS)
+_HTTP_THRESHOLD = _HTTP_TOTAL // 2
+
 # Configuration schema
 CONFIG_SCHEMA = vol.Schema({}, extra=vol.ALLOW_EXTRA)
 
 
-async def async_dns_query(nameserver: str, query: str = 'google.com') -> bool:
-    """Perform DNS query in executor to avoid blocking."""
+def _probe_deadline(deadline: float | None, timeout: float = _PROBE_TIMEOUT) -> float:
+    """Return the loop time a single probe must finish by.
+
+    A probe gets at most ``timeout`` seconds but never runs past the
+    overall ``deadline`` of the check it belongs to.
+    """
+    probe_deadline = asyncio.get_running_loop().time() + timeout
+    return probe_deadline if deadline is None else min(deadline, probe_deadline)
+
+
+async def async_dns_query(
+    nameserver: str,
+    query: str = 'google.com',
+    cache: Dict[Tuple[str, str], Tuple[float, bool]] | None = None,
+    deadline: float | None = None
+) -> bool:
+    """Perform DNS query on the event loop using the asyncio resolver.
+
+    When a cache is given, fresh results are returned without querying:
+    successes are reused for DNS_CACHE_TTL seconds, failures only for
+    DNS_NEGATIVE_CACHE_TTL so outages are still noticed promptly.
+    """
+    key = (nameserver, query)
+    if cache is not None and key in cache:
+        timestamp, result = cache[key]
+        ttl = DNS_CACHE_TTL if result else DNS_NEGATIVE_CACHE_TTL
+        if time.monotonic() - timestamp < ttl:
+            return result
+
     try:
-        resolver = dns.resolver.Resolver()
+        resolver = dns.asyncresolver.Resolver()
         resolver.nameservers = [nameserver]
-        resolver.lifetime = 5
+        resolver.lifetime = _PROBE_TIMEOUT
 
-        loop = asyncio.get_running_loop()
-        await loop.run_in_executor(None, resolver.resolve, query, 'A')
-        return True
+        async with asyncio.timeout_at(_probe_deadline(deadline)):
+            await resolver.resolve(query, 'A')
+        result = True
     except Exception as e:
         _LOGGER.debug(f"DNS query failed: {str(e)}")
-        return False
+        result = False
+
+    if cache is not None:
+        cache[key] = (time.monotonic(), result)
+    return result
+
+@dataclass(slots=True)
+class CheckResult:
+    """Outcome of one group of connectivity probes."""
+
+    success: bool
+    details: Dict
+    success_count: int
+    total_count: int
+
 
 class InternetHealthChecker:
     """Class to handle internet health checking."""
@@ -44,143 +139,181 @@ class InternetHealthChecker:
         self.last_check_time = None
         self.failed_checks = []
         self.confidence_score = 0
-        self.tcp_ports = [80, 443]
-        self.tcp_targets = [
-            ('google.com', 'Google'),
-            ('amazon.com', 'Amazon'),
-            ('cloudflare.com', 'Cloudflare'),
-            ('github.com', 'GitHub'),
-            ('microsoft.com', 'Microsoft')
-        ]
+        self._dns_cache: Dict[Tuple[str, str], Tuple[float, bool]] = {}
+        self._history: deque[int] = deque(maxlen=3)
+        self._tcp_addresses: Dict[str, Tuple[float, str]] = {}
 
-    async def check_dns_multi(self) -> Dict:
+    async def check_dns_multi(self, deadline: float | None = None) -> CheckResult:
         """Test DNS resolution using multiple nameservers."""
-        nameservers = [
-            ('8.8.8.8', 'Google'),
-            ('1.1.1.1', 'Cloudflare'),
-            ('9.9.9.9', 'Quad9'),
-            ('208.67.222.222', 'OpenDNS')
-        ]
         results = {}
         success = 0
 
-        for server, name in nameservers:
+        _LOGGER.debug("Testing DNS using %s...", ', '.join(name for _, name in _NAMESERVERS))
+        tasks = [async_dns_query(server, cache=self._dns_cache, deadline=deadline) for server, _ in _NAMESERVERS]
+        # async_dns_query handles its own errors and only ever returns a bool
+        outcomes = await asyncio.gather(*tasks)
+
+        for (server, name), ok in zip(_NAMESERVERS, outcomes):
+            results[name.lower()] = ok
+            if ok:
+                success += 1
+                _LOGGER.debug("✓ DNS using %s successful!", name)
+            else:
+                self.failed_checks.append(f"DNS ({name}) check failed: DNS resolution failed")
+
+        return CheckResult(
+            success=success >= _DNS_THRESHOLD,
+            details=results,
+            success_count=success,
+            total_count=_DNS_TOTAL
+        )
+
+
+    async def _resolve_tcp_targets(self, deadline: float | None = None) -> Dict[str, str]:
+        """Resolve each TCP target to an IPv4 address, reusing fresh lookups.
+
+        Hosts that cannot be resolved map to themselves so the connection
+        attempt still runs and reports the failure.
+        """
+        loop = asyncio.get_running_loop()
+        now = time.monotonic()
+        stale = [
+            host for host, _ in _TCP_TARGETS
+            if host not in self._tcp_addresses
+            or now - self._tcp_addresses[host][0] >= DNS_CACHE_TTL
+        ]
+
+        if stale:
             try:
-                _LOGGER.warning(f"Testing DNS using {name}...")
-                if await async_dns_query(server):
-                    results[name.lower()] = True
-                    success += 1
-                    _LOGGER.warning(f"✓ DNS using {name} successful!")
-                else:
-                    raise Exception("DNS resolution failed")
-            except Exception as e:
-                self.failed_checks.append(f"DNS ({name}) check failed: {str(e)}")
-                results[name.lower()] = False
+                async with asyncio.timeout_at(_probe_deadline(deadline)):
+                    infos = await asyncio.gather(
+                        *(loop.getaddrinfo(host, None, family=socket.AF_INET, type=socket.SOCK_STREAM)
+                          for host in stale),
+                        return_exceptions=True
+                    )
+            except TimeoutError as e:
+                infos = [e] * len(stale)
+            for host, info in zip(stale, infos):
+                if isinstance(info, BaseException) or not info:
+                    _LOGGER.debug("Failed to resolve %s: %s", host, info)
+                    self._tcp_addresses.pop(host, None)
+                    continue
+                self._tcp_addresses[host] = (now, info[0][4][0])
 
         return {
-            'success': success >= 2,
-            'details': results,
-            'success_count': success,
-            'total_count': len(nameservers)
+            host: self._tcp_addresses[host][1] if host in self._tcp_addresses else host
+            for host, _ in _TCP_TARGETS
         }
 
-
-    async def check_tcp_ports(self) -> Dict:
+    async def check_tcp_ports(self, deadline: float | None = None) -> CheckResult:
         """Test TCP connectivity to major sites."""
         results = {}
         success_count = 0
-        total_checks = len(self.tcp_targets) * len(self.tcp_ports)
-
-        for host, name in self.tcp_targets:
-            host_results = {}
-            for port in self.tcp_ports:
-                try:
-                    _LOGGER.warning(f"Testing TCP {port} to {name}...")
-                    # Add timeout to connection attempt
-                    reader, writer = await asyncio.wait_for(
-                        asyncio.open_connection(host, port),
-                        timeout=5
-                    )
-                    writer.close()
-                    await writer.wait_closed()
-                    host_results[f'port_{port}'] = True
-                    _LOGGER.warning(f"✓ TCP {port} to {name} successful!")
-                    success_count += 1
-                except Exception as e:
-                    self.failed_checks.append(f"TCP {port} to {name} failed: {str(e)}")
-                    host_results[f'port_{port}'] = False
-            results[name.lower()] = host_results
+        addresses = await self._resolve_tcp_targets(deadline)
 
-        return {
-            'success': success_count >= (total_checks // 2),
-            'details': results,
-            'success_count': success_count,
-            'total_count': total_checks
-        }
+        async def probe(host: str, name: str, port: int) -> bool:
+            """Open and close a single TCP connection."""
+            try:
+                _LOGGER.debug("Testing TCP %s to %s...", port, name)
+                # Add timeout to connection attempt
+                async with asyncio.timeout_at(_probe_deadline(deadline)):
+                    reader, writer = await asyncio.open_connection(addresses[host], port)
+                writer.close()
+                await writer.wait_closed()
+                _LOGGER.debug("✓ TCP %s to %s successful!", port, name)
+                return True
+            except Exception as e:
+                self.failed_checks.append(f"TCP {port} to {name} failed: {str(e)}")
+                return False
+
+        outcomes = await asyncio.gather(*(probe(host, name, port) for host, name, port in _TCP_PROBES))
 
-    async def check_http_connectivity(self) -> Dict:
+        for (host, name, port), success in zip(_TCP_PROBES, outcomes):
+            results.setdefault(name.lower(), {})[f'port_{port}'] = success
+            if success:
+                success_count += 1
+
+        return CheckResult(
+            success=success_count >= _TCP_THRESHOLD,
+            details=results,
+            success_count=success_count,
+            total_count=_TCP_TOTAL
+        )
+
+    async def _probe_url(
+        self,
+        session: aiohttp.ClientSession,
+        url: str,
+        expected_status: int,
+        deadline: float | None = None
+    ) -> bool:
+        """Send a HEAD request to a URL and report whether it answered as expected."""
+        try:
+            _LOGGER.debug("Testing HTTP to %s...", url)
+            async with asyncio.timeout_at(_probe_deadline(deadline)):
+                async with session.head(url, allow_redirects=False) as response:
+                    success = response.status == expected_status
+            if success:
+                _LOGGER.debug("✓ HTTP to %s successful!", url)
+            return success
+        except Exception as e:
+            self.failed_checks.append(f"HTTP check to {url} failed: {str(e)}")
+            return False
+
+    async def check_http_connectivity(self, deadline: float | None = None) -> CheckResult:
         """Test HTTP connectivity to major sites."""
-        urls = [
-            'http://www.google.com',
-            'http://www.cloudflare.com',
-            'http://www.apple.com'
-        ]
         results = {}
         success_count = 0
 
-        async with aiohttp.ClientSession() as session:
-            for url in urls:
-                try:
-                    _LOGGER.warning(f"Testing HTTP to {url}...")
-                    async with session.get(url, timeout=5) as response:
-                        success = response.status == 200
-                        results[url] = success
-                        if success:
-                            success_count += 1
-                            _LOGGER.warning(f"✓ HTTP to {url} successful!")
-                except Exception as e:
-                    self.failed_checks.append(f"HTTP check to {url} failed: {str(e)}")
-                    results[url] = False
+        # Home Assistant's shared session owns the pool, so it is never closed here
+        session = async_get_clientsession(self.hass)
+        outcomes = await asyncio.gather(
+            *(self._probe_url(session, url, status, deadline) for url, status in _HTTP_URLS),
+            return_exceptions=True
+        )
 
-        return {
-            'success': success_count >= (len(urls) // 2),
-            'details': results,
-            'success_count': success_count,
-            'total_count': len(urls)
-        }
+        for (url, _), outcome in zip(_HTTP_URLS, outcomes):
+            if isinstance(outcome, BaseException):
+                self.failed_checks.append(f"HTTP check to {url} failed: {str(outcome)}")
+                outcome = False
+            results[url] = outcome
+            if outcome:
+                success_count += 1
+
+        return CheckResult(
+            success=success_count >= _HTTP_THRESHOLD,
+            details=results,
+            success_count=success_count,
+            total_count=_HTTP_TOTAL
+        )
 
-    def calculate_confidence(self, results: Dict) -> float:
+    def calculate_confidence(self, results: Dict[str, CheckResult]) -> float:
         """Calculate confidence level in internet status."""
-        weights = {
-            'tcp': 0.45,
-            'http': 0.35,
-            'dns': 0.20
-        }
-
         confidence = 0
-        _LOGGER.warning("Calculating confidence scores:")
+        _LOGGER.debug("Calculating confidence scores:")
 
-        for test, weight in weights.items():
-            if test in results and results[test]['success']:
-                success_rate = results[test].get('success_count', 0) / results[test].get('total_count', 1)
+        for test, weight in _CONFIDENCE_WEIGHTS:
+            result = results.get(test)
+            if result and result.success:
+                success_rate = result.success_count / result.total_count
                 test_confidence = weight * success_rate
                 confidence += test_confidence
-                _LOGGER.warning(f"{test}: {success_rate*100}% success rate = {test_confidence*100}% confidence contribution")
+                _LOGGER.debug(
+                    "%s: %s%% success rate = %s%% confidence contribution",
+                    test, success_rate * 100, test_confidence * 100
+                )
 
         final_confidence = round(confidence * 100, 1)
-        _LOGGER.warning(f"Total confidence: {final_confidence}%")
+        _LOGGER.info("Total confidence: %s%%", final_confidence)
         return final_confidence
 
     async def update_check_history(self, passed_checks: int):
         """Update the rolling history of health checks."""
         try:
-            for i in range(1, 3):
-                old_value = float(self.hass.states.get(f'input_number.internet_health_check_{i}').state)
-                await self.hass.services.async_call(
-                    'input_number', 'set_value',
-                    {'entity_id': f'input_number.internet_health_check_{i+1}', 'value': old_value}
-                )
+            self._history.appendleft(passed_checks)
 
+            # Only the latest result is mirrored to the helper entity; the
+            # full window is exposed as the check_history sensor attribute
             await self.hass.services.async_call(
                 'input_number', 'set_value',
                 {'entity_id': 'input_number.internet_health_check_1', 'value': passed_checks}
@@ -190,22 +323,49 @@ class InternetHealthChecker:
         except Exception as e:
             _LOGGER.error(f"Failed to update check history: {str(e)}")
 
+    async def _quick_tcp(self, deadline: float | None = None) -> bool:
+        """Check whether a single well-known host accepts a TCP connection."""
+        host, port = _QUICK_TCP_TARGET
+        try:
+            async with asyncio.timeout_at(_probe_deadline(deadline, _QUICK_TCP_TIMEOUT)):
+                reader, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            await writer.wait_closed()
+            return True
+        except Exception as e:
+            self.failed_checks.append(f"Quick TCP {port} to {host} failed: {str(e)}")
+            return False
+
     async def check_all(self) -> Dict:
         """Run all internet health checks and return results."""
-        _LOGGER.warning("🌊 Starting enhanced internet health checks")
+        _LOGGER.debug("🌊 Starting enhanced internet health checks")
         self.failed_checks = []
         self.last_check_time = datetime.now()
+        # Single deadline shared by every probe in this run
+        deadline = asyncio.get_running_loop().time() + _CHECK_TIMEOUT
+
+        if not await self._quick_tcp(deadline):
+            _LOGGER.info("Quick TCP check failed, skipping full health checks")
+            await self.update_check_history(0)
+            return {
+                'status': False,
+                'timestamp': self.last_check_time,
+                'confidence': 0,
+                'checks': {},
+                'failed_reasons': self.failed_checks,
+                'passed_checks': 0,
+                'total_checks': 3,
+                'check_history': list(self._history)
+            }
 
         try:
-            # Add timeout to the gather operation
-            tcp_result, http_result, dns_result = await asyncio.wait_for(
-                asyncio.gather(
-                    self.check_tcp_ports(),
-                    self.check_http_connectivity(),
-                    self.check_dns_multi()
-                ),
-                timeout=30  # Overall timeout for all checks
-            )
+            # Backstop for anything between probes; each probe already stops at the deadline
+            async with asyncio.timeout_at(deadline):
+                tcp_result, http_result, dns_result = await asyncio.gather(
+                    self.check_tcp_ports(deadline),
+                    self.check_http_connectivity(deadline),
+                    self.check_dns_multi(deadline)
+                )
 
             results = {
                 'tcp': tcp_result,
@@ -214,24 +374,25 @@ class InternetHealthChecker:
             }
 
             confidence = self.calculate_confidence(results)
-            passed_checks = sum(1 for r in results.values() if r['success'])
+            passed_checks = sum(1 for r in results.values() if r.success)
 
             await self.update_check_history(passed_checks)
 
-            status = tcp_result['success'] and http_result['success'] and confidence >= 60
+            status = tcp_result.success and http_result.success and confidence >= _CONFIDENCE_THRESHOLD
 
             return {
                 'status': status,
                 'timestamp': self.last_check_time,
                 'confidence': confidence,
-                'checks': results,
+                'checks': {test: asdict(result) for test, result in results.items()},
                 'failed_reasons': self.failed_checks,
                 'passed_checks': passed_checks,
-                'total_checks': len(results)
+                'total_checks': len(results),
+                'check_history': list(self._history)
             }
 
-        except asyncio.TimeoutError:
-            _LOGGER.error("Health check timed out after 30 seconds")
+        except TimeoutError:
+            _LOGGER.error("Health check timed out after %s seconds", _CHECK_TIMEOUT)
             await self.update_check_history(0)
             return {
                 'status': False,
@@ -240,7 +401,8 @@ class InternetHealthChecker:
                 'checks': {},
                 'failed_reasons': ["System error: Health check timed out"],
                 'passed_checks': 0,
-                'total_checks': 3
+                'total_checks': 3,
+                'check_history': list(self._history)
             }
         except Exception as e:
             _LOGGER.error(f"Auwe! Big crash in health check: {str(e)}")
@@ -252,7 +414,8 @@ class InternetHealthChecker:
                 'checks': {},
                 'failed_reasons': [f"System error: {str(e)}"],
                 'passed_checks': 0,
-                'total_checks': 3
+                'total_checks': 3,
+                'check_history': list(self._history)
             }
 
 
@@ -276,7 +439,7 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
                 _LOGGER.info("Internet health check service called")
                 result = await checker.check_all()
 
-                _LOGGER.warning(f"Setting sensor state: {'online' if result['status'] else 'offline'}")
+                _LOGGER.debug("Setting sensor state: %s", 'online' if result['status'] else 'offline')
                 hass.states.async_set(
                     'sensor.internet_health',
                     'online' if result['status'] else 'offline',